@@ -1,11 +1,17 @@
 import os
+import sys
 import time
 import uuid
+import shutil
 import subprocess
 import threading
+import webbrowser
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-from PIL import Image, ImageTk
+from PIL import Image, __version__ as PIL_VERSION
+import av
 from pathlib import Path
 
 # Constants for Telegram sticker requirements
@@ -15,52 +21,109 @@ MAX_VIDEO_SIZE_KB = 256  # KB
 ICON_SIZE = 100  # pixels
 MAX_ICON_SIZE_KB = 32  # KB
 VIDEO_FPS = 30
+WEBP_QUALITY = 90
+WEBP_METHOD = 6  # 0 = fastest save, 6 = smallest file
 OUTPUT_DIR = "output"
+MAX_WORKERS = min(4, os.cpu_count() or 1)  # parallel conversions
 
 # Ensure the output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# pillow-simd releases carry a ".postN" suffix; plain Pillow has slower LANCZOS kernels.
+# Only mention it when run from a console (sys.stdout is None under pythonw)
+if ".post" not in PIL_VERSION and sys.stdout is not None and sys.stdout.isatty():
+    print(f"Using Pillow {PIL_VERSION} without SIMD; install pillow-simd for faster image resizing")
+
 def clean_temp_files():
     """Clean temporary processed files"""
-    for file in os.listdir(OUTPUT_DIR):
-        file_path = os.path.join(OUTPUT_DIR, file)
-        try:
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error removing file {file_path}: {e}")
+    with os.scandir(OUTPUT_DIR) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    print(f"Error removing file {entry.path}: {e}")
 
 def resize_image(input_path, output_path, output_format='webp', is_icon=False):
     """Resize image to fit Telegram sticker requirements or icon requirements"""
     try:
-        # Open the image
-        img = Image.open(input_path)
-        
-        if is_icon:
-            # For icons, use fixed 100x100 size
-            new_width = new_height = ICON_SIZE
-        else:
-            # Calculate new dimensions
-            width, height = img.size
-            ratio = MAX_IMAGE_SIZE / max(width, height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-        
-        # Resize the image
-        img = img.resize((new_width, new_height), Image.LANCZOS)
-        
-        # Save in the appropriate format
-        if output_format == 'webp':
-            img.save(output_path, 'WEBP', quality=95)
-        else:  # png
-            img.save(output_path, 'PNG')
+        # Open the image; the context manager closes the file handle
+        with Image.open(input_path) as img:
+            # Copy static inputs that already meet the size and format requirements as-is
+            if is_icon:
+                compliant = img.size == (ICON_SIZE, ICON_SIZE)
+            else:
+                compliant = max(img.size) == MAX_IMAGE_SIZE
+            # Animated WEBP/APNG must still be re-saved as a single frame
+            compliant = compliant and not getattr(img, "is_animated", False)
+            if compliant and (img.format or "").lower() == output_format:
+                shutil.copyfile(input_path, output_path)
+                return True
+            
+            # Let JPEG decoding scale down via IDCT; a no-op for other formats
+            target = ICON_SIZE if is_icon else MAX_IMAGE_SIZE
+            img.draft("RGB", (target, target))
+            
+            # Decode fully so later steps only touch in-memory pixel data
+            img.load()
+            
+            if is_icon:
+                # For icons, use fixed 100x100 size
+                img = img.resize((ICON_SIZE, ICON_SIZE), Image.LANCZOS)
+            elif max(img.size) > MAX_IMAGE_SIZE:
+                # Downscale in place; reducing_gap decimates before resampling
+                img.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.LANCZOS, reducing_gap=2.0)
+            else:
+                # thumbnail never enlarges, so scale small images up explicitly
+                width, height = img.size
+                ratio = MAX_IMAGE_SIZE / max(width, height)
+                new_width = int(width * ratio)
+                new_height = int(height * ratio)
+                img = img.resize((new_width, new_height), Image.LANCZOS)
             
+            # Save in the appropriate format
+            if output_format == 'webp':
+                # Palette and bilevel images compress better losslessly
+                lossless = img.mode in ("P", "1")
+                img.save(output_path, 'WEBP', quality=WEBP_QUALITY, method=WEBP_METHOD, lossless=lossless)
+            else:  # png
+                img.save(output_path, 'PNG')
+        
         return True
     except Exception as e:
         print(f"Error resizing image: {e}")
         return False
 
-def convert_video(input_path, output_path, is_icon=False):
+def _ffmpeg_encode(input_path, output_path, video_filter, bitrate, tile_columns, threads):
+    """Run a single-pass constrained-quality VP9 encode"""
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        # Short clips don't need deep input probing before encoding
+        "-probesize", "32", "-analyzeduration", "0", "-fpsprobesize", "0",
+        "-i", input_path,
+        "-t", str(MAX_VIDEO_DURATION),  # Max 3 seconds
+        "-vf", video_filter,
+        "-c:v", "libvpx-vp9",
+        "-pix_fmt", "yuva420p",  # Format with alpha channel
+        "-an",  # No audio
+        # Constrained quality: CRF target, capped by the size-derived bitrate
+        "-crf", "32",
+        "-b:v", f"{bitrate}k",
+        "-minrate", "0",
+        "-maxrate", f"{int(bitrate * 1.2)}k",
+        "-bufsize", f"{bitrate * 2}k",
+        # libvpx only honours the realtime deadline in one-pass encodes
+        "-deadline", "realtime",
+        "-cpu-used", "6",
+        "-auto-alt-ref", "0",
+        "-row-mt", "1",
+        "-tile-columns", tile_columns,
+        "-threads", threads,
+        output_path,
+    ]
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+def convert_video(input_path, output_path, is_icon=False, threads=None):
     """Convert video to WEBM with VP9 codec for Telegram stickers or sticker icons"""
     try:
         # Ensure output path is .webm
@@ -71,19 +134,24 @@ def convert_video(input_path, output_path, is_icon=False):
         target_size = ICON_SIZE if is_icon else MAX_IMAGE_SIZE
         max_size_kb = MAX_ICON_SIZE_KB if is_icon else MAX_VIDEO_SIZE_KB
         
-        # Get video dimensions using FFprobe
-        cmd = [
-            "ffprobe", "-v", "error", "-select_streams", "v:0",
-            "-show_entries", "stream=width,height", "-of", "csv=p=0", input_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        # Parse dimensions or use defaults
+        # Get video dimensions and duration in-process with PyAV
         try:
-            dimensions = result.stdout.strip().split(",")
-            width = int(dimensions[0])
-            height = int(dimensions[1])
-        except (ValueError, IndexError):
+            with av.open(input_path) as container:
+                stream = container.streams.video[0]
+                width = stream.codec_context.width
+                height = stream.codec_context.height
+                if container.duration:
+                    duration = container.duration / av.time_base
+                elif stream.duration and stream.time_base:
+                    duration = float(stream.duration * stream.time_base)
+                else:
+                    duration = MAX_VIDEO_DURATION
+        except (av.error.FFmpegError, IndexError):
+            width = height = 0
+            duration = MAX_VIDEO_DURATION
+        
+        # Unprobed codec parameters report 0x0; use defaults like a failed open
+        if not width or not height:
             width, height = 1280, 720
         
         # For icons, use fixed 100x100 size
@@ -99,43 +167,30 @@ def convert_video(input_path, output_path, is_icon=False):
             new_width = new_width if new_width % 2 == 0 else new_width + 1
             new_height = new_height if new_height % 2 == 0 else new_height + 1
         
-        # Try different bitrates until we get file size below limit
-        # Start with lower bitrate for icons
-        bitrate = 150 if is_icon else 300
-        success = False
+        # Derive the bitrate from the size budget, keeping a 10% safety margin
+        duration = min(duration, MAX_VIDEO_DURATION) if duration > 0 else MAX_VIDEO_DURATION
+        bitrate = int(max_size_kb * 8 / duration * 0.9)
         
-        for attempt in range(5):  # Try up to 5 different bitrates
-            # Add loop filter for icons to ensure looping
-            loop_filter = ",loop=0:32767:0" if is_icon else ""
-            
-            # Direct FFmpeg command with VP9 codec
-            cmd = [
-                "ffmpeg", "-y", "-i", input_path,
-                "-t", str(MAX_VIDEO_DURATION),  # Max 3 seconds
-                "-vf", f"scale={new_width}:{new_height},fps={VIDEO_FPS}{loop_filter}",
-                "-c:v", "libvpx-vp9",
-                "-pix_fmt", "yuva420p",  # Format with alpha channel
-                "-an",  # No audio
-                "-b:v", f"{bitrate}k",
-                "-crf", "30",
-                "-deadline", "good",
-                "-auto-alt-ref", "0",
-                output_path
-            ]
-            
-            # Run the command
-            subprocess.run(cmd, capture_output=True, check=True)
-            
-            # Check if file is within size limit
-            file_size_kb = os.path.getsize(output_path) / 1024
-            
+        # Add loop filter for icons to ensure looping
+        loop_filter = ",loop=0:32767:0" if is_icon else ""
+        video_filter = f"scale={new_width}:{new_height},fps={VIDEO_FPS}{loop_filter}"
+        
+        # Tile columns don't help at icon resolution, but row-mt still does
+        tile_columns = "0" if is_icon else "2"
+        threads = str(threads or min(8, os.cpu_count() or 4))
+        
+        _ffmpeg_encode(input_path, output_path, video_filter, bitrate, tile_columns, threads)
+        file_size_kb = os.path.getsize(output_path) / 1024
+        
+        # Realtime CQ can overshoot its target severalfold on complex content, so
+        # rescale from the measured size for up to 3 corrective re-encodes
+        for attempt in range(3):
             if file_size_kb <= max_size_kb:
-                success = True
                 break
-            
-            # Reduce bitrate for next attempt
-            bitrate = int(bitrate * 0.6)  # Reduce by 40%
-            print(f"File too large: {file_size_kb:.1f} KB. Trying with bitrate {bitrate}k")
+            bitrate = int(bitrate * max_size_kb / file_size_kb * 0.9)
+            print(f"File too large: {file_size_kb:.1f} KB. Retrying with bitrate {bitrate}k")
+            _ffmpeg_encode(input_path, output_path, video_filter, bitrate, tile_columns, threads)
+            file_size_kb = os.path.getsize(output_path) / 1024
         
         return os.path.exists(output_path) and file_size_kb <= max_size_kb
     
@@ -164,8 +219,12 @@ class TelegramStickerApp:
         self.create_video_icon = tk.BooleanVar(value=False)
         self.create_image_icon = tk.BooleanVar(value=False)
         
+        # Status messages from the worker thread, drained on the Tk main loop
+        self._log_queue = queue.Queue()
+        
         # Create UI
         self.create_ui()
+        self.root.after(100, self._drain_log)
         
     def create_ui(self):
         # Main frame
@@ -340,122 +399,98 @@ class TelegramStickerApp:
         self.status_text.insert(tk.END, text)
         self.status_text.see(tk.END)
         self.status_text.config(state="disabled")
-        self.root.update()
+    
+    def _drain_log(self):
+        # Move all pending worker messages into the status box in one insert
+        lines = []
+        while True:
+            try:
+                lines.append(self._log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self.update_status("".join(lines))
+        self.root.after(100, self._drain_log)
     
     def processing_thread(self):
         # Clean temporary files
         clean_temp_files()
         
         processed_files = []
-        self.update_status("", append=False)
         
-        # Process images
-        if self.image_files:
-            self.update_status(f"Processing {len(self.image_files)} images...\n")
-            for i, img_path in enumerate(self.image_files):
-                try:
-                    filename = os.path.basename(img_path)
-                    output_filename = f"sticker_{i+1}_{int(time.time())}.{self.output_format.get()}"
-                    output_path = os.path.join(OUTPUT_DIR, output_filename)
-                    
-                    self.update_status(f"• Processing image: {filename}... ")
-                    self.root.update()  # Force UI update to show progress
-                    
-                    success = resize_image(img_path, output_path, self.output_format.get())
-                    
-                    if success:
-                        processed_files.append(output_path)
-                        self.update_status("✓\n")
-                    else:
-                        self.update_status("❌ Failed\n")
-                except Exception as e:
-                    self.update_status(f"❌ Error: {str(e)}\n")
+        # Collect every conversion as a (label, input, output, function, args) job
+        jobs = []
+        ts = int(time.time())
+        image_format = self.output_format.get()
+        create_video_icon = self.create_video_icon.get() and self.icon_video_file
+        
+        # Split the CPU between the video encodes that can actually run at once
+        video_jobs = len(self.video_files) + (1 if create_video_icon else 0)
+        video_threads = min(8, max(1, (os.cpu_count() or 4) // max(1, min(MAX_WORKERS, video_jobs))))
+        
+        for i, img_path in enumerate(self.image_files):
+            output_filename = f"sticker_{i+1}_{ts}_{uuid.uuid4().hex[:6]}.{image_format}"
+            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            jobs.append(("image", img_path, output_path,
+                         resize_image, (img_path, output_path, image_format)))
+        
+        for i, video_path in enumerate(self.video_files):
+            output_filename = f"sticker_{i+1}_{ts}_{uuid.uuid4().hex[:6]}.webm"
+            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            jobs.append(("video", video_path, output_path,
+                         convert_video, (video_path, output_path, False, video_threads)))
+        
+        # Video sticker set icon (100x100, 32KB max)
+        if create_video_icon:
+            output_filename = f"icon_video_{ts}_{uuid.uuid4().hex[:6]}.webm"
+            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            jobs.append(("icon video", self.icon_video_file, output_path,
+                         convert_video, (self.icon_video_file, output_path, True, video_threads)))
+        
+        # Static image sticker set icon (100x100), same format as the stickers
+        if self.create_image_icon.get() and self.icon_image_file:
+            output_filename = f"icon_static_{ts}_{uuid.uuid4().hex[:6]}.{image_format}"
+            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            jobs.append(("icon image", self.icon_image_file, output_path,
+                         resize_image, (self.icon_image_file, output_path, image_format, True)))
         
-        # Process videos
-        if self.video_files:
-            self.update_status(f"\nProcessing {len(self.video_files)} videos...\n")
-            for i, video_path in enumerate(self.video_files):
+        self._log_queue.put(f"Processing {len(jobs)} file(s)...\n")
+        
+        # Run conversions in parallel and report each one as it finishes
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(func, *args): (label, input_path, output_path)
+                       for label, input_path, output_path, func, args in jobs}
+            
+            for future in as_completed(futures):
+                label, input_path, output_path = futures[future]
+                filename = os.path.basename(input_path)
                 try:
-                    filename = os.path.basename(video_path)
-                    output_filename = f"sticker_{i+1}_{int(time.time())}.webm"
-                    output_path = os.path.join(OUTPUT_DIR, output_filename)
-                    
-                    self.update_status(f"• Processing video: {filename}... ")
-                    self.root.update()  # Force UI update to show progress
-                    
-                    # Convert video to WEBM format for Telegram stickers
-                    success = convert_video(video_path, output_path)
-                    
-                    if success:
-                        processed_files.append(output_path)
-                        self.update_status("✓\n")
-                    else:
-                        self.update_status("❌ Failed\n")
+                    success = future.result()
                 except Exception as e:
-                    self.update_status(f"❌ Error: {str(e)}\n")
-                    
-                # Force UI update after each video to show progress
-                self.root.update()
-        
-        # Process video sticker set icon if enabled
-        if self.create_video_icon.get() and self.icon_video_file:
-            self.update_status(f"\nProcessing video sticker set icon...\n")
-            try:
-                filename = os.path.basename(self.icon_video_file)
-                output_filename = f"icon_video_{int(time.time())}.webm"
-                output_path = os.path.join(OUTPUT_DIR, output_filename)
-                
-                self.update_status(f"• Processing icon video: {filename}... ")
-                self.root.update()  # Force UI update to show progress
-                
-                # Convert video to icon format (100x100, 32KB max)
-                success = convert_video(self.icon_video_file, output_path, is_icon=True)
+                    self._log_queue.put(f"• {label.capitalize()}: {filename} ❌ Error: {str(e)}\n")
+                    continue
                 
                 if success:
                     processed_files.append(output_path)
-                    self.update_status("✓\n")
-                    self.update_status("  (Icon must be set separately in @Stickers bot)\n")
+                    self._log_queue.put(f"• {label.capitalize()}: {filename} ✓\n")
+                    if label.startswith("icon"):
+                        self._log_queue.put("  (Icon must be set separately in @Stickers bot)\n")
+                elif label == "icon video":
+                    self._log_queue.put(f"• {label.capitalize()}: {filename} ❌ Failed - Could not meet size requirements\n")
                 else:
-                    self.update_status("❌ Failed - Could not meet size requirements\n")
-            except Exception as e:
-                self.update_status(f"❌ Error: {str(e)}\n")
-        
-        # Process static image sticker set icon if enabled
-        if self.create_image_icon.get() and self.icon_image_file:
-            self.update_status(f"\nProcessing static image sticker set icon...\n")
-            try:
-                filename = os.path.basename(self.icon_image_file)
-                # Use the same format as selected for stickers or default to webp
-                icon_format = self.output_format.get()
-                output_filename = f"icon_static_{int(time.time())}.{icon_format}"
-                output_path = os.path.join(OUTPUT_DIR, output_filename)
-                
-                self.update_status(f"• Processing icon image: {filename}... ")
-                self.root.update()  # Force UI update to show progress
-                
-                # Resize image to icon format (100x100)
-                success = resize_image(self.icon_image_file, output_path, icon_format, is_icon=True)
-                
-                if success:
-                    processed_files.append(output_path)
-                    self.update_status("✓\n")
-                    self.update_status("  (Icon must be set separately in @Stickers bot)\n")
-                else:
-                    self.update_status("❌ Failed\n")
-            except Exception as e:
-                self.update_status(f"❌ Error: {str(e)}\n")
+                    self._log_queue.put(f"• {label.capitalize()}: {filename} ❌ Failed\n")
         
         # Complete processing
         if processed_files:
-            self.update_status(f"\nProcessing complete!\n")
-            self.update_status(f"Files saved to: {os.path.abspath(OUTPUT_DIR)}\n")
+            self._log_queue.put(f"\nProcessing complete!\n")
+            self._log_queue.put(f"Files saved to: {os.path.abspath(OUTPUT_DIR)}\n")
             
             # Update UI from main thread
             self.root.after(0, lambda: self.result_label.config(
                 text=f"Processed {len(processed_files)} file(s) to output folder"))
             self.root.after(0, lambda: self.open_output_btn.config(state="normal"))
         else:
-            self.update_status("\nNo files were successfully processed.\n")
+            self._log_queue.put("\nNo files were successfully processed.\n")
     
     def process_files(self):
         has_icon = (self.create_video_icon.get() and self.icon_video_file) or (self.create_image_icon.get() and self.icon_image_file)
@@ -466,6 +501,7 @@ class TelegramStickerApp:
         # Reset result section
         self.result_label.config(text="")
         self.open_output_btn.config(state="disabled")
+        self.update_status("", append=False)
         
         # Start processing in a separate thread
         threading.Thread(target=self.processing_thread, daemon=True).start()
@@ -474,10 +510,10 @@ class TelegramStickerApp:
         # Open file explorer to the output directory
         folder_path = os.path.abspath(OUTPUT_DIR)
         if os.path.exists(folder_path):
-            try:
+            if sys.platform == "win32":
                 os.startfile(folder_path)
-            except AttributeError:  # if not on Windows
-                subprocess.call(["open", folder_path])
+            else:  # Finder on macOS, xdg-open on Linux
+                webbrowser.open(Path(folder_path).as_uri())
 
 # Main application entry point
 if __name__ == "__main__":